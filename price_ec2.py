@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 import argparse
+import csv
+import gzip
+import hashlib
+import heapq
 import json
 import math
+import re
 import shutil
 import sys
 from collections import defaultdict
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 from functools import cached_property, lru_cache
+from pathlib import Path
 
 import boto3
 from tabulate import tabulate, tabulate_formats
@@ -40,6 +46,225 @@ cache_dir = XDG_CACHE_HOME / 'price-ec2' / 'http'
 shutil.rmtree(cache_dir, ignore_errors=True)
 
 
+class Cassette:
+    """
+    Recorded AWS responses, so a later run can be replayed without touching the
+    network. Each response (or page of a paginated response) is stored as
+    objects/<sha256 of its content>.json.gz, and index.json.gz maps a hash of
+    each request onto the objects it returned.
+
+    >>> key = Cassette.key
+    >>> key('ec2', None, 'describe_volumes', {'A': 1, 'B': 2}) == key(
+    ...     'ec2', None, 'describe_volumes', {'B': 2, 'A': 1}
+    ... )
+    True
+    >>> key('cloudwatch', None, 'get_metric_statistics', {'StartTime': datetime(2024, 1, 1)}) == key(
+    ...     'cloudwatch', None, 'get_metric_statistics', {'StartTime': datetime.now()}
+    ... )
+    True
+    >>> from tempfile import mkdtemp
+    >>> directory = mkdtemp()
+    >>> recording = Cassette(directory)
+    >>> recording.call('ec2', 'us-west-2', 'meta.region_name', {}, lambda: 'us-west-2')
+    'us-west-2'
+    >>> recording.call('ec2', 'us-west-2', 'describe_volumes', {}, lambda: {'Volumes': []})
+    {'Volumes': []}
+    >>> pages = [{'Snapshots': [{'VolumeSize': 8}]}, {'Snapshots': [{'VolumeSize': 8}]}]
+    >>> for page in recording.pages('ec2', 'us-west-2', 'describe_snapshots', {}, lambda: iter(pages)):
+    ...     print(page)
+    {'Snapshots': [{'VolumeSize': 8}]}
+    {'Snapshots': [{'VolumeSize': 8}]}
+    >>> recording.save()
+    >>> len(list(Path(directory, 'objects').iterdir()))  # identical pages are stored once
+    3
+    >>> replaying = Cassette(directory, replay=True)
+    >>> replaying.call('ec2', 'us-west-2', 'describe_volumes', {}, fetch=None)
+    {'Volumes': []}
+    >>> len(list(replaying.pages('ec2', 'us-west-2', 'describe_snapshots', {}, fetch=None)))
+    2
+    >>> replaying.call('ec2', 'us-east-1', 'describe_volumes', {}, fetch=None)
+    Traceback (most recent call last):
+    ...
+    Exception: no recorded response for ec2 describe_volumes
+    >>> client = CassetteClient(replaying, 'ec2', 'us-west-2')
+    >>> client.meta.region_name, client.describe_volumes()
+    ('us-west-2', {'Volumes': []})
+    >>> client.exceptions
+    Traceback (most recent call last):
+    ...
+    AttributeError: 'exceptions' is not supported by --record/--replay
+    >>> shutil.rmtree(directory)
+    """
+
+    def __init__(self, directory, replay=False):
+        self.directory = Path(directory)
+        self.replay = replay
+        self.index = {}
+        if replay:
+            with gzip.open(self.directory / 'index.json.gz', 'rt') as f:
+                self.index = json.load(f)
+        else:
+            (self.directory / 'objects').mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(service, region_name, operation, kwargs):
+        # time ranges move with every run, so they can't be part of the key
+        kwargs = {k: v for (k, v) in kwargs.items() if not isinstance(v, datetime)}
+        request = json.dumps(
+            [service, region_name, operation, kwargs], sort_keys=True, default=str
+        )
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def _object(self, digest):
+        return self.directory / 'objects' / f'{digest}.json.gz'
+
+    def _write(self, response):
+        content = json.dumps(response, sort_keys=True, default=str).encode()
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._object(digest)
+        if not path.exists():
+            path.write_bytes(gzip.compress(content))
+        return digest
+
+    def _read(self, digest):
+        # much faster than gzip.open for lots of small objects
+        return json.loads(gzip.decompress(self._object(digest).read_bytes()))
+
+    def _recorded(self, service, region_name, operation, kwargs):
+        key = self.key(service, region_name, operation, kwargs)
+        if key not in self.index:
+            raise Exception(f'no recorded response for {service} {operation}')
+        return self.index[key]
+
+    def call(self, service, region_name, operation, kwargs, fetch):
+        if self.replay:
+            (digest,) = self._recorded(service, region_name, operation, kwargs)
+            return self._read(digest)
+        response = fetch()
+        key = self.key(service, region_name, operation, kwargs)
+        self.index[key] = [self._write(response)]
+        return response
+
+    def pages(self, service, region_name, operation, kwargs, fetch):
+        """
+        Like call, but for a paginated operation; pages are written or read
+        one at a time, so they're never all held in memory.
+        """
+        if self.replay:
+            for digest in self._recorded(service, region_name, operation, kwargs):
+                yield self._read(digest)
+            return
+        digests = []
+        for page in fetch():
+            digests.append(self._write(page))
+            yield page
+        # only once complete, so a partial pagination is never replayed
+        self.index[self.key(service, region_name, operation, kwargs)] = digests
+
+    def save(self):
+        with gzip.open(self.directory / 'index.json.gz', 'wt') as f:
+            json.dump(self.index, f)
+
+
+# the client operations the fetch functions use, which are all --record/--replay support
+CASSETTE_OPERATIONS = frozenset(
+    (
+        'describe_instances',
+        'describe_volumes',
+        'describe_snapshots',
+        'describe_db_instances',
+        'describe_cache_clusters',
+        'list_clusters',
+        'list_tasks',
+        'describe_tasks',
+        'get_products',
+        'get_metric_statistics',
+    )
+)
+
+
+class CassetteClient:
+    def __init__(self, cassette, service, region_name):
+        self._cassette = cassette
+        self._service = service
+        self._region_name = region_name
+        self._client = None
+        if not cassette.replay:
+            self._client = boto3.client(service, region_name=region_name)
+        self.meta = argparse.Namespace(
+            region_name=self._call(
+                'meta.region_name', {}, lambda: self._client.meta.region_name
+            )
+        )
+
+    def _call(self, operation, kwargs, fetch):
+        return self._cassette.call(
+            self._service, self._region_name, operation, kwargs, fetch
+        )
+
+    def __getattr__(self, operation):
+        if operation not in CASSETTE_OPERATIONS:
+            raise AttributeError(f'{operation!r} is not supported by --record/--replay')
+
+        def call(**kwargs):
+            def fetch():
+                response = getattr(self._client, operation)(**kwargs)
+                response.pop('ResponseMetadata', None)
+                return response
+
+            return self._call(operation, kwargs, fetch)
+
+        return call
+
+    def get_paginator(self, operation):
+        if operation not in CASSETTE_OPERATIONS:
+            raise AttributeError(f'{operation!r} is not supported by --record/--replay')
+        return CassettePaginator(self, operation)
+
+
+class CassettePaginator:
+    def __init__(self, client, operation):
+        self._client = client
+        self._operation = operation
+
+    def paginate(self, **kwargs):
+        def fetch():
+            paginator = self._client._client.get_paginator(self._operation)
+            for page in paginator.paginate(**kwargs):
+                yield {k: v for (k, v) in page.items() if k != 'ResponseMetadata'}
+
+        client = self._client
+        return client._cassette.pages(
+            client._service,
+            client._region_name,
+            'paginate.' + self._operation,
+            kwargs,
+            fetch,
+        )
+
+
+cassette = None
+
+
+@contextmanager
+def use_cassette(record=None, replay=None):
+    global cassette
+    if record or replay:
+        cassette = Cassette(record or replay, replay=bool(replay))
+    try:
+        yield
+        if record:
+            cassette.save()
+    finally:
+        cassette = None
+
+
+def aws_client(service, region_name=None):
+    if cassette is None:
+        return boto3.client(service, region_name=region_name)
+    return CassetteClient(cassette, service, region_name)
+
+
 def fetch_pricing(service, filters):
     return fetch_pricing_(
         service, tuple((k, filters[k]) for k in sorted(filters.keys()))
@@ -48,7 +273,7 @@ def fetch_pricing(service, filters):
 
 @lru_cache(maxsize=1024)
 def fetch_pricing_(service, filters):
-    client = boto3.client('pricing', region_name='us-east-1')
+    client = aws_client('pricing', region_name='us-east-1')
     response = client.get_products(
         ServiceCode=service,
         Filters=[
@@ -73,12 +298,22 @@ class Instance:
         self.type = type
         self.state = state
         self.az = az
+        self.tags = None  # only fetched for EC2
+        self.count = 1
         self.cpu_usage = None
 
     @property
     def running(self):
         return True
 
+    @property
+    def service(self):
+        return self.SERVICE
+
+    @property
+    def billing_ids(self):
+        return [self.id]
+
     @property
     def region(self):
         return self.az[:-1]
@@ -118,6 +353,7 @@ class Instance:
 
 
 class EC2Instance(Instance):
+    SERVICE = 'EC2'
     CLOUDWATCH_NAMESPACE = 'AWS/EC2'
     ID_DIMENSION = 'InstanceId'
 
@@ -134,6 +370,10 @@ class EC2Instance(Instance):
     def total_storage(self):
         return sum(v.size for v in self.volumes)
 
+    @property
+    def billing_ids(self):
+        return [self.id] + [v.id for v in self.volumes]
+
     def unit_price(self):
         if self.type == 'm1.small':
             search_type = region_usagetype[self.region] + 'BoxUsage'
@@ -155,19 +395,7 @@ class EC2Instance(Instance):
 
     @cached_property
     def storage_costs(self):
-        costs = defaultdict(float)
-        for volume in self.volumes:
-            volume_costs = list(volume.unit_price(self.region))
-            for c in volume_costs:
-                if c.per.startswith('gb-'):
-                    costs[c.per[3:]] += c.dollars * volume.size
-                elif c.per.startswith('iops-'):
-                    costs[c.per[5:]] += c.dollars * volume.iops
-                else:
-                    costs[c.per] += c.dollars
-        if len(costs) == 0:
-            return [Cost(0, 'Mo')]
-        return [Cost(b, a) for (a, b) in costs.items()]
+        return volume_storage_costs(self.volumes, self.region)
 
     @staticmethod
     def from_json(json):
@@ -182,6 +410,7 @@ class EC2Instance(Instance):
         az = json['Placement']['AvailabilityZone']
         platform = json.get('Platform', 'linux')
         instance = EC2Instance(id, name, type, state, az, platform)
+        instance.tags = {tag['Key']: tag['Value'] for tag in json.get('Tags', [])}
         for mapping in json['BlockDeviceMappings']:
             instance.volumes.append(Volume(mapping['Ebs']['VolumeId'], instance.region))
         return instance
@@ -218,7 +447,136 @@ class Volume:
                     yield Cost(dimension['pricePerUnit']['USD'], dimension['unit'])
 
 
+def volume_storage_costs(volumes, region):
+    costs = defaultdict(float)
+    for volume in volumes:
+        volume_costs = list(volume.unit_price(region))
+        for c in volume_costs:
+            if c.per.startswith('gb-'):
+                costs[c.per[3:]] += c.dollars * volume.size
+            elif c.per.startswith('iops-'):
+                costs[c.per[5:]] += c.dollars * volume.iops
+            else:
+                costs[c.per] += c.dollars
+    if len(costs) == 0:
+        return [Cost(0, 'Mo')]
+    return [Cost(b, a) for (a, b) in costs.items()]
+
+
+class StorageGroup(Instance):
+    """
+    Storage that isn't attached to any instance, aggregated into one row per
+    (region, type) so accounts with huge numbers of volumes or snapshots stay
+    readable, and pricing is only resolved once per row.
+
+    >>> class Client:
+    ...     meta = argparse.Namespace(region_name='us-west-2')
+    ...     pages = {
+    ...         'describe_volumes': [
+    ...             {'Volumes': [{'VolumeType': 'gp2', 'Size': 100, 'Iops': 300}] * 2},
+    ...             {'Volumes': [{'VolumeType': 'io1', 'Size': 50, 'Iops': 1000}]},
+    ...         ],
+    ...         'describe_snapshots': [
+    ...             {'Snapshots': [{'VolumeSize': 8, 'StorageTier': 'standard'}] * 3},
+    ...             {'Snapshots': [{'VolumeSize': 8, 'StorageTier': 'archive',
+    ...                             'FullSnapshotSizeInBytes': 2 * 2**30}]},
+    ...         ],
+    ...     }
+    ...     def get_paginator(self, operation):
+    ...         return argparse.Namespace(paginate=lambda **kwargs: iter(self.pages[operation]))
+    >>> for g in fetch_unattached_volume_info(Client()) + fetch_snapshot_info(Client()):
+    ...     print(g.id, g.name, g.count, g.total_storage)
+    unattached volumes:us-west-2:gp2 2 unattached volumes 2 200
+    unattached volumes:us-west-2:io1 1 unattached volumes 1 50
+    snapshots:us-west-2:standard 3 snapshots (upper bound) 3 24
+    snapshots:us-west-2:archive 1 snapshots 1 2.0
+    >>> volume = fetch_unattached_volume_info(Client())[0].volume
+    >>> volume.type, volume.size, volume.iops
+    ('gp2', 200, 600)
+    """
+
+    SERVICE = 'EBS'
+
+    def __init__(self, kind, type, state, region, count, size):
+        super().__init__(
+            f'{kind}:{region}:{type}', f'{count} {kind}', type, state, region
+        )
+        self._region = region
+        self.count = count
+        self.size = size
+
+    @property
+    def region(self):
+        return self._region
+
+    @property
+    def total_storage(self):
+        return self.size
+
+    @property
+    def billing_ids(self):
+        return []
+
+    def unit_price(self):
+        yield Cost(0, 'Hrs')
+
+
+class UnattachedVolumes(StorageGroup):
+    def __init__(self, type, region, count, size, iops):
+        super().__init__('unattached volumes', type, 'available', region, count, size)
+        self.iops = iops
+
+    @property
+    def volume(self):
+        # volume pricing is linear in size and iops, so price the group as one big volume
+        volume = Volume(self.id, self.region)
+        volume.type = self.type
+        volume.size = self.size
+        volume.iops = self.iops
+        return volume
+
+    @cached_property
+    def storage_costs(self):
+        return volume_storage_costs([self.volume], self.region)
+
+
+class SnapshotStorage(StorageGroup):
+    def __init__(self, tier, region, count, size):
+        super().__init__('snapshots', tier, 'completed', region, count, size)
+        if tier != 'archive':
+            # see fetch_snapshot_info
+            self.name += ' (upper bound)'
+
+    @cached_property
+    def storage_costs(self):
+        if self.type == 'archive':
+            search_type = 'EBS:SnapshotArchiveStorage'
+        else:
+            search_type = 'EBS:SnapshotUsage'
+
+        pricing = fetch_pricing(
+            'AmazonEC2',
+            {
+                'regionCode': self.region,
+                'usageType': region_usagetype[self.region] + search_type,
+            },
+        )
+
+        costs = defaultdict(float)
+        for term in pricing['terms']['OnDemand'].values():
+            for dimension in term['priceDimensions'].values():
+                c = Cost(dimension['pricePerUnit']['USD'], dimension['unit'])
+                if c.per.startswith('gb-'):
+                    costs[c.per[3:]] += c.dollars * self.size
+                else:
+                    costs[c.per] += c.dollars
+        if len(costs) == 0:
+            return [Cost(0, 'Mo')]
+        return [Cost(b, a) for (a, b) in costs.items()]
+
+
 class DBInstance(Instance):
+    SERVICE = 'RDS'
     CLOUDWATCH_NAMESPACE = 'AWS/RDS'
     ID_DIMENSION = 'DBInstanceIdentifier'
 
@@ -330,6 +688,7 @@ class DBInstance(Instance):
 
 
 class CacheInstance(Instance):
+    SERVICE = 'ElastiCache'
     CLOUDWATCH_NAMESPACE = 'AWS/ElastiCache'
     ID_DIMENSION = (
         'CacheClusterId'  # this isn't quite right. we're ignoring CacheNodeId
@@ -371,6 +730,7 @@ class CacheInstance(Instance):
 
 
 class FargateInstance(Instance):
+    SERVICE = 'Fargate'
     CLOUDWATCH_NAMESPACE = 'AWS/ECS'
     # ID_DIMENSION doesn't work -- stat is by cluster/service not instance
 
@@ -500,6 +860,52 @@ def fetch_volume_info(client, instances):
         volume.iops = v.get('Iops')
 
 
+def fetch_unattached_volume_info(client, **kwargs):
+    groups = defaultdict(lambda: [0, 0, 0])
+    pages = client.get_paginator('describe_volumes').paginate(
+        Filters=[{'Name': 'status', 'Values': ['available']}], **kwargs
+    )
+    for page in pages:
+        for v in page['Volumes']:
+            totals = groups[v['VolumeType']]
+            totals[0] += 1
+            totals[1] += v['Size']
+            totals[2] += v.get('Iops') or 0
+
+    region = client.meta.region_name
+    return [
+        UnattachedVolumes(type, region, count, size, iops)
+        for (type, (count, size, iops)) in groups.items()
+    ]
+
+
+def fetch_snapshot_info(client, **kwargs):
+    groups = defaultdict(lambda: [0, 0])
+    pages = client.get_paginator('describe_snapshots').paginate(
+        OwnerIds=['self'],
+        Filters=[{'Name': 'status', 'Values': ['completed']}],
+        **kwargs,
+    )
+    for page in pages:
+        for s in page['Snapshots']:
+            tier = s.get('StorageTier', 'standard')
+            totals = groups[tier]
+            totals[0] += 1
+            if tier == 'archive' and 'FullSnapshotSizeInBytes' in s:
+                # archived snapshots are billed on their full size
+                totals[1] += s['FullSnapshotSizeInBytes'] / 2**30
+            else:
+                # VolumeSize is the size of the source volume, which is an upper
+                # bound on the (incremental) storage that's actually billed
+                totals[1] += s['VolumeSize']
+
+    region = client.meta.region_name
+    return [
+        SnapshotStorage(tier, region, count, size)
+        for (tier, (count, size)) in groups.items()
+    ]
+
+
 def fetch_db_info(client, **kwargs):
     db_metadata = client.describe_db_instances(**kwargs)
 
@@ -550,7 +956,17 @@ def just_one(costs, per):
     return total
 
 
+# columns of build_instance_cost_table that add up across instances
+SUMMED_COLUMNS = (4, 5, 6, 7, 9)
+
+GROUP_BY_FIELDS = ('service', 'region', 'az', 'type', 'state')
+
+
 def build_instance_cost_table(instances, include_cpu=False, per='day'):
+    """
+    Returns the table headers and a generator yielding one row per instance,
+    so callers can aggregate or select rows without holding the whole table.
+    """
     headers = (
         'name',
         'id',
@@ -596,68 +1012,149 @@ def build_instance_cost_table(instances, include_cpu=False, per='day'):
                 row += (None, None)
         return row
 
-    return headers, [build_row(i) for i in instances]
+    return headers, (build_row(i) for i in instances)
+
+
+def group_by_field(field):
+    if field in GROUP_BY_FIELDS or (field.startswith('tag:') and len(field) > 4):
+        return field
+    raise argparse.ArgumentTypeError(
+        f'expected one of {", ".join(GROUP_BY_FIELDS)} or tag:KEY'
+    )
+
 
+def group_value(instance, field):
+    if field.startswith('tag:'):
+        return (instance.tags or {}).get(field[4:], '')
+    return getattr(instance, field) or ''
 
-def print_instance_cost_table(instances, total=True, tablefmt='simple', per='day'):
-    include_cpu = any(i.cpu_usage for i in instances)
+
+def group_cost_table(instances, headers, rows, group_by):
+    """
+    Aggregates per-instance rows (as built by build_instance_cost_table) into
+    one row per distinct group_by key, with a count and the summed columns.
+    """
+    groups = {}
+    untagged = 0
+    by_tag = any(field.startswith('tag:') for field in group_by)
+    for instance, row in zip(instances, rows, strict=True):
+        if by_tag and instance.tags is None:
+            untagged += instance.count
+        key = tuple(group_value(instance, field) for field in group_by)
+        sums = groups.get(key)
+        if sums is None:
+            sums = groups[key] = [0] * (1 + len(SUMMED_COLUMNS))
+        sums[0] += instance.count
+        for n, column in enumerate(SUMMED_COLUMNS, 1):
+            sums[n] += row[column]
+
+    if untagged:
+        print(
+            f'% warning: tags are only fetched for EC2, so {untagged} other'
+            ' resources are grouped under an empty tag value',
+            file=sys.stderr,
+        )
+
+    group_headers = (
+        tuple(group_by) + ('count',) + tuple(headers[c] for c in SUMMED_COLUMNS)
+    )
+    return group_headers, [key + tuple(sums) for (key, sums) in groups.items()]
+
+
+def accumulate(rows, totals, columns):
+    """
+    Passes rows through unchanged, adding the given columns into totals.
+
+    >>> totals = defaultdict(int)
+    >>> list(accumulate([('a', 1, 2), ('b', 3, 4)], totals, (1, 2)))
+    [('a', 1, 2), ('b', 3, 4)]
+    >>> dict(totals)
+    {1: 4, 2: 6}
+    """
+    for row in rows:
+        for column in columns:
+            totals[column] += row[column]
+        yield row
+
+
+def print_instance_cost_table(
+    instances, total=True, tablefmt='simple', per='day', group_by=None, top=None
+):
+    include_cpu = not group_by and any(i.cpu_usage for i in instances)
     cost_index = -1
     if include_cpu:
         cost_index = -3
 
-    headers, table = build_instance_cost_table(
+    headers, rows = build_instance_cost_table(
         instances, include_cpu=include_cpu, per=per
     )
+    summed_columns = SUMMED_COLUMNS
+    count = len(instances)
+    if group_by:
+        headers, rows = group_cost_table(instances, headers, rows, group_by)
+        summed_columns = range(len(group_by), len(headers))
+        count = len(rows)
+
+    totals = defaultdict(int)
+    rows = accumulate(rows, totals, summed_columns)
+
     # cost decreasing, name increasing
-    table.sort(key=lambda x: (-x[cost_index], x[0]))
+    def sort_key(x):
+        return (-x[cost_index], x[0])
+
+    if top is not None:
+        # nsmallest keeps a bounded heap, rather than sorting every row
+        table = heapq.nsmallest(top, rows, key=sort_key)
+    else:
+        table = sorted(rows, key=sort_key)
     if total:
-        total_row = (
-            'Total',
-            '',
-            '',
-            '',
-            sum(r[4] for r in table),
-            sum(r[5] for r in table),
-            sum(r[6] for r in table),
-            sum(r[7] for r in table),
-            '',
-            sum(r[9] for r in table),
-        )
-        if include_cpu:
-            total_row += (None, None)
-        table.append(total_row)
+        if len(table) < count:
+            # so the shown rows and this one add up to the total below
+            other_row = tuple(
+                totals[c] - sum(r[c] for r in table) if c in summed_columns else None
+                for c in range(len(headers))
+            )
+            table.append((f'(other {count - len(table)})',) + other_row[1:])
+        total_row = tuple(totals.get(c) for c in range(len(headers)))
+        table.append(('Total',) + total_row[1:])
     print(tabulate(table, headers=headers, tablefmt=tablefmt))
 
 
 def fetch_all_instances(region_name=None):
     with progress('fetching EC2 instances'):
-        client = boto3.client('ec2', region_name=region_name)
+        client = aws_client('ec2', region_name=region_name)
         # instances = fetch_instance_info(Filters=[{'Name': 'tag:Environment', 'Values': ['TUS']}])
         instances = fetch_instance_info(client)
         fetch_volume_info(client, instances)
         return instances
 
 
+def fetch_all_orphaned_storage(region_name=None):
+    with progress('fetching unattached EBS volumes and snapshots'):
+        client = aws_client('ec2', region_name=region_name)
+        return fetch_unattached_volume_info(client) + fetch_snapshot_info(client)
+
+
 def fetch_all_db_instances(region_name=None):
     with progress('fetching RDS instances'):
-        client = boto3.client('rds', region_name=region_name)
+        client = aws_client('rds', region_name=region_name)
         return fetch_db_info(client)
 
 
 def fetch_all_cache_instances(region_name=None):
     with progress('fetching ElastiCache instances'):
-        client = boto3.client('elasticache', region_name=region_name)
+        client = aws_client('elasticache', region_name=region_name)
         return fetch_cache_info(client)
 
 
 def fetch_all_fargate_instances(region_name=None):
     with progress('fetching Fargate instances'):
-        client = boto3.client('ecs', region_name=region_name)
+        client = aws_client('ecs', region_name=region_name)
         return fetch_fargate_info(client)
 
 
 def fetch_cpu_usage(instances, region_name=None):
-    client = boto3.client('cloudwatch', region_name=region_name)
+    client = aws_client('cloudwatch', region_name=region_name)
     end_time = datetime.now()
     start_time = end_time + timedelta(weeks=-1)
 
@@ -684,12 +1181,385 @@ def cloudwatch_cpu_usage(client, namespace, dimensions, start_time, end_time):
     return [p['Average'] for p in stats['Datapoints']]
 
 
+# usage types that the pricing code above has an estimate for, without region prefix
+PRICED_USAGE_TYPES = (
+    'BoxUsage',
+    'EBS:VolumeUsage',
+    'EBS:VolumeP-IOPS',
+    'InstanceUsage:',
+    'Multi-AZUsage:',
+    'RDS:GP2-Storage',
+    'RDS:PIOPS-Storage',
+    'RDS:PIOPS',
+    'RDS:StorageUsage',
+    'RDS:Multi-AZ-GP2-Storage',
+    'RDS:Multi-AZ-PIOPS-Storage',
+    'RDS:Multi-AZ-PIOPS',
+    'RDS:Multi-AZ-StorageUsage',
+    'NodeUsage:',
+    'Fargate-vCPU-Hours:perCPU',
+    'Fargate-GB-Hours',
+    'Fargate-ARM-vCPU-Hours:perCPU',
+    'Fargate-ARM-GB-Hours',
+)
+
+# the column holding what was effectively paid, for each line item type we count;
+# RI-covered usage has an unblended cost of 0, and SP-covered usage the on-demand price
+BILLED_LINE_ITEM_TYPES = {
+    'Usage': 'line_item_unblended_cost',
+    'DiscountedUsage': 'reservation_effective_cost',
+    'SavingsPlanCoveredUsage': 'savings_plan_savings_plan_effective_cost',
+}
+
+CUR_COLUMNS = (
+    'line_item_line_item_type',
+    'line_item_resource_id',
+    'line_item_usage_type',
+    'line_item_unblended_cost',
+    'line_item_usage_start_date',
+    'line_item_usage_end_date',
+)
+
+# only present when the account has reservations or savings plans
+OPTIONAL_CUR_COLUMNS = (
+    'reservation_effective_cost',
+    'savings_plan_savings_plan_effective_cost',
+)
+
+
+def cur_column(name):
+    """
+    Normalizes legacy CSV column names to the CUR 2.0/Parquet form.
+
+    >>> cur_column('lineItem/UnblendedCost')
+    'line_item_unblended_cost'
+    >>> cur_column('line_item_usage_type')
+    'line_item_usage_type'
+    """
+    return re.sub(r'(?<=[a-z0-9])([A-Z])', r'_\1', name.replace('/', '_')).lower()
+
+
+def split_usage_type(usage_type):
+    """
+    >>> split_usage_type('USW2-BoxUsage:t3.micro')
+    ('us-west-2', 'BoxUsage:t3.micro')
+    >>> split_usage_type('EBS:VolumeUsage.gp2')
+    ('us-east-1', 'EBS:VolumeUsage.gp2')
+    """
+    for region, prefix in region_usagetype.items():
+        if prefix and usage_type.startswith(prefix):
+            return region, usage_type[len(prefix) :]
+    return 'us-east-1', usage_type
+
+
+def billing_id(resource_id):
+    """
+    Maps a CUR resource id (which may be an ARN) onto Instance.billing_ids.
+
+    >>> billing_id('i-0123456789abcdef0')
+    'i-0123456789abcdef0'
+    >>> billing_id('arn:aws:rds:us-east-1:123456789012:db:orders')
+    'orders'
+    >>> billing_id('arn:aws:ecs:us-east-1:123456789012:task/web/0123abcd')
+    'web/0123abcd'
+    """
+    if not resource_id.startswith('arn:'):
+        return resource_id
+    resource = resource_id.split(':', 5)[5]
+    return re.split('[:/]', resource, maxsplit=1)[-1]
+
+
+# legacy CUR billing period directories, e.g. 20241101-20241201
+CUR_BILLING_PERIOD = re.compile(r'\d{8}-\d{8}')
+
+
+def cur_manifest_files(manifest):
+    """
+    Returns the report files a legacy CUR manifest lists as current, or None
+    for manifests without reportKeys (e.g. CUR 2.0 exports).
+    """
+    with open(manifest) as f:
+        keys = json.load(f).get('reportKeys')
+    if keys is None:
+        return None
+
+    period = manifest.parent
+    files = []
+    for key in keys:
+        parts = key.split('/')
+        if period.name not in parts:
+            raise Exception(f'{manifest} lists {key}, outside of {period.name}')
+        f = period.joinpath(*parts[parts.index(period.name) + 1 :])
+        if not f.exists():
+            raise Exception(f'{manifest} lists {f}, which is missing')
+        files.append(f)
+    return files
+
+
+def cur_files(path):
+    """
+    Finds the report files under path. Legacy CURs keep superseded
+    <assemblyId>/ directories next to the current one, so each billing period's
+    manifest decides which of them to read.
+
+    >>> from tempfile import mkdtemp
+    >>> root = Path(mkdtemp())
+    >>> for f in ['20241101-20241201/old/r-1.csv.gz', '20241101-20241201/new/r-1.csv.gz',
+    ...           '20241101-20241201/new/r-2.csv.gz', '20241201-20250101/a/r-1.csv.gz']:
+    ...     (root / f).parent.mkdir(parents=True, exist_ok=True)
+    ...     (root / f).touch()
+    >>> _ = (root / '20241101-20241201' / 'r-Manifest.json').write_text(json.dumps({
+    ...     'reportKeys': ['cur/r/20241101-20241201/new/r-1.csv.gz',
+    ...                    'cur/r/20241101-20241201/new/r-2.csv.gz']}))
+    >>> [str(f.relative_to(root)) for f in cur_files(root)]
+    ['20241101-20241201/new/r-1.csv.gz', '20241101-20241201/new/r-2.csv.gz', '20241201-20250101/a/r-1.csv.gz']
+    >>> (root / '20241201-20250101/b').mkdir()
+    >>> (root / '20241201-20250101/b/r-1.csv.gz').touch()
+    >>> list(cur_files(root))  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    Exception: ... has several assemblies (a, b); include its Manifest.json or remove superseded ones
+    >>> shutil.rmtree(root)
+    """
+    path = Path(path)
+    if path.is_file():
+        return [path]
+
+    manifests = {}
+    for manifest in sorted(path.rglob('*-Manifest.json')):
+        # there's another copy of the manifest inside each assembly directory
+        if CUR_BILLING_PERIOD.fullmatch(manifest.parent.name):
+            files = cur_manifest_files(manifest)
+            if files is not None:
+                manifests[manifest.parent] = files
+
+    files = [f for period in sorted(manifests) for f in manifests[period]]
+    assemblies = defaultdict(set)
+    for f in sorted(path.rglob('*')):
+        if not f.name.endswith(('.csv', '.csv.gz', '.parquet')):
+            continue
+        if any(p in manifests for p in f.parents):
+            continue
+        if CUR_BILLING_PERIOD.fullmatch(f.parent.parent.name):
+            assemblies[f.parent.parent].add(f.parent.name)
+        files.append(f)
+
+    for period, names in assemblies.items():
+        if len(names) > 1:
+            raise Exception(
+                f'{period} has several assemblies ({", ".join(sorted(names))});'
+                ' include its Manifest.json or remove superseded ones'
+            )
+    return files
+
+
+def check_cur_columns(path, columns):
+    missing = [c for c in CUR_COLUMNS if c not in columns]
+    if missing:
+        raise Exception(f'{path} is missing CUR columns: {", ".join(missing)}')
+
+
+def read_cur_csv(path):
+    opener = gzip.open if path.name.endswith('.gz') else open
+    with opener(path, 'rt', newline='') as f:
+        reader = csv.reader(f)
+        columns = [cur_column(c) for c in next(reader)]
+        check_cur_columns(path, columns)
+        indexes = [
+            (columns.index(c), c)
+            for c in CUR_COLUMNS + OPTIONAL_CUR_COLUMNS
+            if c in columns
+        ]
+        for row in reader:
+            yield {c: row[i] for (i, c) in indexes}
+
+
+def read_cur_parquet(path, batch_size=65536):
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception(f'pyarrow is required to read {path}') from None
+
+    parquet = pyarrow.parquet.ParquetFile(path)
+    check_cur_columns(path, [cur_column(c) for c in parquet.schema_arrow.names])
+    columns = [
+        c
+        for c in parquet.schema_arrow.names
+        if cur_column(c) in CUR_COLUMNS + OPTIONAL_CUR_COLUMNS
+    ]
+    for batch in parquet.iter_batches(batch_size=batch_size, columns=columns):
+        for row in batch.to_pylist():
+            yield {cur_column(c): v for (c, v) in row.items()}
+
+
+def read_cur(path):
+    for f in cur_files(path):
+        if f.name.endswith('.parquet'):
+            yield from read_cur_parquet(f)
+        else:
+            yield from read_cur_csv(f)
+
+
+def cur_datetime(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def aggregate_cur(line_items):
+    """
+    Sums billed line items by (billing id, usage type), keeping the time span
+    they cover, as {(id, usage_type): [dollars, start, end]}.
+    """
+    billed = {}
+    for item in line_items:
+        resource_id = item.get('line_item_resource_id')
+        if not resource_id:
+            continue
+        cost_column = BILLED_LINE_ITEM_TYPES.get(item['line_item_line_item_type'])
+        if cost_column is None:
+            continue
+        if cost_column not in item:
+            raise Exception(
+                f'found {item["line_item_line_item_type"]} line items, but no {cost_column} column'
+            )
+        _, usage_type = split_usage_type(item['line_item_usage_type'])
+        if not usage_type.startswith(PRICED_USAGE_TYPES):
+            continue
+
+        start = cur_datetime(item['line_item_usage_start_date'])
+        end = cur_datetime(item['line_item_usage_end_date'])
+        dollars = float(item[cost_column] or 0)
+        key = (billing_id(resource_id), usage_type)
+        total = billed.get(key)
+        if total is None:
+            billed[key] = [dollars, start, end]
+        else:
+            total[0] += dollars
+            total[1] = min(total[1], start)
+            total[2] = max(total[2], end)
+    return billed
+
+
+def build_reconcile_table(instances, billed, per='day', tolerance=10):
+    """
+    Joins estimated costs against aggregate_cur output, returning only the
+    resources whose billed rate differs from the estimate by more than
+    tolerance percent.
+
+    >>> def instance(id, type):
+    ...     i = Instance(id, id, type, 'running', 'us-west-2a')
+    ...     i.instance_costs = [Cost(0.1, 'Hrs')]
+    ...     return i
+    >>> def line_item(resource_id, usage_type, hour, line_item_type='Usage', **costs):
+    ...     start = datetime(2024, 11, 1) + timedelta(hours=hour)
+    ...     return dict(
+    ...         line_item_line_item_type=line_item_type,
+    ...         line_item_resource_id=resource_id,
+    ...         line_item_usage_type=usage_type,
+    ...         line_item_unblended_cost=costs.get('unblended', 0),
+    ...         reservation_effective_cost=costs.get('reservation', ''),
+    ...         line_item_usage_start_date=start,
+    ...         line_item_usage_end_date=start + timedelta(hours=1),
+    ...     )
+    >>> billed = aggregate_cur(
+    ...     [line_item('i-web', 'USW2-BoxUsage:t3.micro', h, unblended=0.2) for h in range(24)]
+    ...     + [line_item('i-web', 'USW2-DataTransfer-Out-Bytes', 0, unblended=5)]
+    ...     + [
+    ...         line_item(
+    ...             'arn:aws:rds:us-west-2:123456789012:db:orders',
+    ...             'USW2-InstanceUsage:db.t3.micro',
+    ...             h,
+    ...             'DiscountedUsage',
+    ...             reservation=0.104,
+    ...         )
+    ...         for h in range(24)
+    ...     ]
+    ... )
+    >>> instances = [
+    ...     instance('i-web', 't3.micro'),
+    ...     instance('orders', 'db.t3.micro'),
+    ...     instance('i-new', 't3.micro'),
+    ... ]
+    >>> headers, table = build_reconcile_table(instances, billed)
+    >>> [(name, round(estimated, 2), billed and round(billed, 2), difference, usage)
+    ...  for (name, _, _, estimated, billed, difference, usage) in table]
+    [('i-web', 2.4, 4.8, 100.0, 'BoxUsage:t3.micro'), ('i-new', 2.4, None, None, None)]
+    """
+    headers = (
+        'name',
+        'id',
+        'type',
+        'estimated $/' + per,
+        'billed $/' + per,
+        'difference %',
+        'billed usage',
+    )
+
+    estimates = {}
+    billing_ids = {}
+    _, rows = build_instance_cost_table(instances, per=per)
+    for instance, row in zip(instances, rows, strict=True):
+        if not instance.billing_ids:
+            continue
+        estimate = estimates.setdefault(instance.id, [row[0], row[3], 0])
+        estimate[2] += row[9]
+        for i in instance.billing_ids:
+            billing_ids[i] = instance.id
+
+    # per instance: [dollars, start, end, usage types]
+    usage = {}
+    for (i, usage_type), (dollars, start, end) in billed.items():
+        if i not in billing_ids:
+            continue
+        total = usage.setdefault(billing_ids[i], [0, start, end, set()])
+        total[0] += dollars
+        total[1] = min(total[1], start)
+        total[2] = max(total[2], end)
+        total[3].add(usage_type)
+
+    table = []
+    for id, (name, type, estimated) in estimates.items():
+        if id in usage:
+            dollars, start, end, usage_types = usage[id]
+            hours = (end - start) / timedelta(hours=1)
+            if hours <= 0:
+                continue
+            billed_dollars = Cost(dollars / hours, 'Hrs')._convert(per).dollars
+            if abs(billed_dollars - estimated) <= estimated * tolerance / 100:
+                continue
+            difference = None
+            if estimated:
+                difference = round((billed_dollars / estimated - 1) * 100, 1)
+            usage_types = ', '.join(sorted(usage_types))
+        else:
+            # not in the report at all, e.g. launched since it was generated
+            billed_dollars = difference = usage_types = None
+        table.append(
+            (name, id, type, estimated, billed_dollars, difference, usage_types)
+        )
+
+    # largest discrepancy first
+    table.sort(key=lambda x: (-abs((x[4] or 0) - x[3]), x[0]))
+    return headers, table
+
+
+def print_reconcile_table(
+    instances, billed, tablefmt='simple', per='day', tolerance=10
+):
+    headers, table = build_reconcile_table(
+        instances, billed, per=per, tolerance=tolerance
+    )
+    print(tabulate(table, headers=headers, tablefmt=tablefmt))
+
+
 def main():
     p = argparse.ArgumentParser()
     p.add_argument('--ec2', action='store_true')
     p.add_argument('--rds', action='store_true')
     p.add_argument('--elasticache', action='store_true')
     p.add_argument('--fargate', action='store_true')
+    p.add_argument('--orphaned-storage', action='store_true')
     p.add_argument('--all-services', action='store_true')
     p.add_argument('--region', nargs='+', dest='regions', metavar='REGION')
     p.add_argument(
@@ -700,31 +1570,80 @@ def main():
         '--cpu-usage', action='store_true'
     )  # note that this costs money; $0.01 per thousand requests
     p.add_argument('--cost-per', choices=['hr', 'day', 'mo', 'yr'], default='day')
+    p.add_argument('--group-by', nargs='+', type=group_by_field, metavar='FIELD')
+    p.add_argument('--top', type=int, metavar='N')
+    recording = p.add_mutually_exclusive_group()
+    recording.add_argument(
+        '--record', metavar='DIR', help='save AWS responses for --replay'
+    )
+    recording.add_argument(
+        '--replay', metavar='DIR', help='use AWS responses saved by --record'
+    )
+
+    p.add_argument(
+        '--reconcile-cur',
+        metavar='PATH',
+        help='compare estimates against a Cost and Usage Report .csv.gz/.parquet file or dir',
+    )
+    p.add_argument('--tolerance', type=float, metavar='PERCENT')
 
     args = p.parse_args()
+    if args.top is not None and args.top < 1:
+        p.error('--top must be at least 1')
+    if args.reconcile_cur and (args.group_by or args.top is not None):
+        p.error('--group-by and --top are not supported with --reconcile-cur')
+    if args.tolerance is not None and not args.reconcile_cur:
+        p.error('--tolerance only applies to --reconcile-cur')
+    if args.tolerance is None:
+        args.tolerance = 10
 
     # default to showing ec2, if nothing selected
-    if not any((args.ec2, args.rds, args.elasticache, args.fargate)):
+    if not any(
+        (args.ec2, args.rds, args.elasticache, args.fargate, args.orphaned_storage)
+    ):
         args.ec2 = True
 
-    all_instances = []
-    for region in args.regions or [None]:
-        instances = []
-        if args.ec2 or args.all_services:
-            instances += fetch_all_instances(region_name=region)
-        if args.rds or args.all_services:
-            instances += fetch_all_db_instances(region_name=region)
-        if args.elasticache or args.all_services:
-            instances += fetch_all_cache_instances(region_name=region)
-        if args.fargate or args.all_services:
-            instances += fetch_all_fargate_instances(region_name=region)
-
-        if args.cpu_usage:
-            fetch_cpu_usage(instances, region_name=region)
-
-        all_instances += instances
-
-    print_instance_cost_table(all_instances, tablefmt=args.tablefmt, per=args.cost_per)
+    with use_cassette(record=args.record, replay=args.replay):
+        all_instances = []
+        for region in args.regions or [None]:
+            instances = []
+            if args.ec2 or args.all_services:
+                instances += fetch_all_instances(region_name=region)
+            if args.rds or args.all_services:
+                instances += fetch_all_db_instances(region_name=region)
+            if args.elasticache or args.all_services:
+                instances += fetch_all_cache_instances(region_name=region)
+            if args.fargate or args.all_services:
+                instances += fetch_all_fargate_instances(region_name=region)
+
+            if args.cpu_usage:
+                fetch_cpu_usage(instances, region_name=region)
+
+            # after fetch_cpu_usage, as storage has no CPU to measure
+            if args.orphaned_storage or args.all_services:
+                instances += fetch_all_orphaned_storage(region_name=region)
+
+            all_instances += instances
+
+        if args.reconcile_cur:
+            with progress('reading Cost and Usage Report'):
+                billed = aggregate_cur(read_cur(args.reconcile_cur))
+            print_reconcile_table(
+                all_instances,
+                billed,
+                tablefmt=args.tablefmt,
+                per=args.cost_per,
+                tolerance=args.tolerance,
+            )
+            return
+
+        print_instance_cost_table(
+            all_instances,
+            tablefmt=args.tablefmt,
+            per=args.cost_per,
+            group_by=args.group_by,
+            top=args.top,
+        )
 
 
 if __name__ == '__main__':